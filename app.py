@@ -1,110 +1,41 @@
 import streamlit as st
-import fitz  # PyMuPDF
-from PIL import Image
-import io, os, base64, requests, json
+import json, time
 from datetime import datetime
+from pathlib import Path
 
+from medical_processor import MedicalOCRProcessor
 
-# ========== Utility Functions ==========
+TITLE_HTML = '<h1 style="text-align:center;color:#1f77b4;">🏥 Medical OCR Analyzer</h1>'
 
-def load_default_api_key():
-    """Load API key from key.txt if available"""
-    if os.path.exists("key.txt"):
-        with open("key.txt", "r", encoding="utf-8") as f:
-            return f.read().strip()
-    return ""
-
-
-def pdf_to_images(pdf_file):
-    """Convert PDF pages to list of PIL images"""
-    images = []
-    doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        pix = page.get_pixmap(dpi=200)
-        img = Image.open(io.BytesIO(pix.tobytes("png")))
-        images.append(img)
-    return images
-
-
-def image_to_base64(image):
-    """Convert PIL image to base64 string"""
-    buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
-    return base64.b64encode(buffered.getvalue()).decode("utf-8")
-
-
-def ocr_via_openrouter(images, api_key, progress_callback=None):
-    """Send images to OpenRouter Claude Opus for OCR"""
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "HTTP-Referer": "http://localhost:8501",
-        "X-Title": "Medical OCR Analyzer"
-    }
-
-    all_text = []
-    total = len(images)
-
-    for idx, img in enumerate(images, start=1):
-        if progress_callback:
-            progress_callback(idx, total)
-
-        img_b64 = image_to_base64(img)
-        payload = {
-            "model": "anthropic/claude-opus-4.1",  # ✅ Claude Opus model
-            "messages": [
-                {"role": "system", "content": "You are an OCR assistant. Extract all text exactly as seen in the image."},
-                {"role": "user", "content": [
-                    {"type": "text", "text": f"OCR page {idx}:"},
-                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_b64}"}}
-                ]}
-            ]
-        }
-
-        try:
-            resp = requests.post(url, headers=headers, json=payload, timeout=120)
-            if resp.status_code == 200:
-                text = resp.json()["choices"][0]["message"]["content"]
-                all_text.append(text)
-            else:
-                all_text.append(f"❌ OCR failed for page {idx}: {resp.text}")
-        except Exception as e:
-            all_text.append(f"⚠️ OCR error on page {idx}: {str(e)}")
+INSTRUCTIONS_MD = """
+1. Enter your OpenRouter API key  
+2. Upload PDFs or images  
+3. Click 'Process Documents'
+"""
 
-    return "\n\n".join(all_text)
 
+# ========== Utility Functions ==========
 
-# ========== Streamlit App ==========
+@st.cache_data(ttl=300, show_spinner=False)
+def load_default_api_key():
+    """Load API key from key.txt if available (cached for 5 minutes)"""
+    try:
+        return Path("key.txt").read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return ""
 
-def main():
-    st.set_page_config(
-        page_title="Medical OCR Analyzer",
-        page_icon="🏥",
-        layout="wide",
-        initial_sidebar_state="expanded"
-    )
 
-    st.markdown('<h1 style="text-align:center;color:#1f77b4;">🏥 Medical OCR Analyzer</h1>', unsafe_allow_html=True)
+@st.cache_resource
+def get_processor():
+    """Shared MedicalOCRProcessor instance for all sessions"""
+    return MedicalOCRProcessor()
 
-    # Sidebar
-    with st.sidebar:
-        st.header("🔑 API Configuration")
-        default_api_key = load_default_api_key()
-        api_key = st.text_input(
-            "OpenRouter API Key",
-            type="password",
-            value=default_api_key,
-            help="Stored in key.txt or paste here"
-        )
 
-        st.header("📋 Instructions")
-        st.markdown("""
-        1. Enter your OpenRouter API key  
-        2. Upload PDFs or images  
-        3. Click 'Process Documents'
-        """)
+# ========== Streamlit App ==========
 
+@st.fragment
+def process_panel(api_key):
+    """Upload and OCR panel; its own widgets rerun only this fragment"""
     # File uploader
     uploaded_files = st.file_uploader(
         "📁 Upload Medical Documents",
@@ -113,42 +44,42 @@ def main():
     )
 
     if uploaded_files and api_key:
+        processor = get_processor()
         if st.button("🚀 Process Documents", use_container_width=True, type="primary"):
             progress_bar = st.progress(0)
             status_text = st.empty()
 
-            def update_progress(done, total):
-                progress_bar.progress(done / total)
-                status_text.text(f"Processing page {done}/{total}...")
-
-            full_text = ""
-            file_results = []
-
-            for file in uploaded_files:
-                try:
-                    if file.type == "application/pdf":
-                        images = pdf_to_images(file)
-                    else:
-                        img = Image.open(file)
-                        images = [img]
-
-                    text = ocr_via_openrouter(images, api_key, progress_callback=update_progress)
-
-                    full_text += f"\n\n===== {file.name} =====\n\n{text}\n"
-                    file_results.append({"filename": file.name, "status": "Success", "pages": len(images)})
-                except Exception as e:
-                    file_results.append({"filename": file.name, "status": f"Failed - {str(e)}"})
+            last_update = [0.0]
+            shown_fraction = [0.0]
+
+            def update_progress(files_done, files_total, pages_done, pages_total):
+                # Cached and text-layer files finish almost instantly; cap redraws at ~10 per second
+                now = time.monotonic()
+                if now - last_update[0] < 0.1 and files_done != files_total:
+                    return
+                last_update[0] = now
+                # pages_total grows as more files are opened; don't let the bar jump backwards
+                fraction = pages_done / pages_total if pages_total else files_done / files_total
+                shown_fraction[0] = max(shown_fraction[0], min(fraction, 1.0))
+                progress_bar.progress(shown_fraction[0])
+                status_text.text(f"Processed page {pages_done}/{pages_total} "
+                                 f"(file {files_done}/{files_total})...")
+
+            full_text, file_results = processor.process_uploaded_files(
+                uploaded_files, api_key, progress_callback=update_progress
+            )
 
             progress_bar.empty()
             status_text.empty()
 
             # Results summary
             st.subheader("📊 Processing Results")
-            for res in file_results:
-                if res["status"] == "Success":
-                    st.success(f"{res['filename']} - ✅ Success ({res['pages']} pages)")
-                else:
-                    st.error(f"{res['filename']} - ❌ {res['status']}")
+            succeeded = sum(res["status"] == "Success" for res in file_results)
+            if succeeded == len(file_results):
+                st.success(f"✅ All {succeeded} files processed")
+            else:
+                st.warning(f"⚠️ {succeeded}/{len(file_results)} files processed without errors")
+            st.dataframe(file_results, use_container_width=True, hide_index=True)
 
             # Full text
             if full_text.strip():
@@ -180,5 +111,35 @@ def main():
         st.warning("⚠️ Please provide your OpenRouter API key.")
 
 
+def main():
+    st.set_page_config(
+        page_title="Medical OCR Analyzer",
+        page_icon="🏥",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+
+    st.markdown(TITLE_HTML, unsafe_allow_html=True)
+
+    # Sidebar
+    with st.sidebar:
+        st.header("🔑 API Configuration")
+        default_api_key = load_default_api_key()
+        api_key = st.text_input(
+            "OpenRouter API Key",
+            type="password",
+            value=default_api_key,
+            help="Stored in key.txt or paste here"
+        )
+        if st.button("🔄 Reload key.txt"):
+            load_default_api_key.clear()
+            st.rerun()
+
+        st.header("📋 Instructions")
+        st.markdown(INSTRUCTIONS_MD)
+
+    process_panel(api_key)
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,39 @@
+import json
+from unittest import mock
+
+import pytest
+import requests
+
+import medical_processor
+from medical_processor import MedicalOCRProcessor
+
+PAGE_JPEG = b"\xff\xd8 page image \xff\xd9"
+
+
+def make_response(status, body=None, headers=None):
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = json.dumps(body or {}).encode("utf-8")
+    resp.headers.update(headers or {})
+    resp.url = "https://openrouter.ai/api/v1/chat/completions"
+    return resp
+
+
+def ocr_response(text):
+    return make_response(200, {"choices": [{"message": {"content": text}}]})
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record backoff sleeps instead of waiting them out"""
+    recorded = []
+    monkeypatch.setattr(medical_processor.time, "sleep", recorded.append)
+    return recorded
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch, sleeps):
+    monkeypatch.setattr(medical_processor, "OCR_CACHE_DIR", tmp_path / "ocr_cache")
+    proc = MedicalOCRProcessor()
+    proc._session = mock.Mock(spec=["post"])
+    return proc
@@ -1,38 +1,224 @@
 import fitz  # PyMuPDF
 from PIL import Image
-import io, base64, requests
+import io, os, base64, hashlib, json, random, threading, time, requests
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+
+OCR_MODEL = "anthropic/claude-opus-4.1"  # ✅ free OCR-capable model
+
+# PDF render resolution, capped so the longer page edge is at most MAX_IMAGE_EDGE pixels
+# (override with OCR_RENDER_DPI / OCR_MAX_IMAGE_EDGE, e.g. higher for faint or noisy scans)
+RENDER_DPI = int(os.environ.get("OCR_RENDER_DPI", 200))
+MAX_IMAGE_EDGE = int(os.environ.get("OCR_MAX_IMAGE_EDGE", 1600))
+# Pages are sent as JPEG; far cheaper to encode and smaller than PNG, and lossless isn't needed for OCR
+JPEG_QUALITY = 85
+
+# Files OCR'd at the same time; each one is mostly waiting on OpenRouter (override with OCR_CONCURRENCY)
+MAX_FILE_WORKERS = max(1, int(os.environ.get("OCR_CONCURRENCY", 4)))
+# Page requests in flight per file
+MAX_PAGE_WORKERS = 8
+# Rendered pages held per file (in flight or queued); more are only rendered as earlier ones finish
+MAX_QUEUED_PAGES = 2 * MAX_PAGE_WORKERS
+# OpenRouter requests in flight across all files and sessions
+MAX_INFLIGHT_REQUESTS = 10
+# Seconds between progress reports while files are still being processed
+PROGRESS_POLL_INTERVAL = 0.25
+# Retries for rate-limited (429), server-error and dropped-connection requests, with exponential backoff
+MAX_RETRIES = 4
+BASE_RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 30.0
+# A server-requested Retry-After is waited out in full up to this many seconds; longer ones fail the page at once
+MAX_RETRY_AFTER = 120.0
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# Optional cap on OpenRouter requests per minute, paced with a token bucket (OCR_REQUESTS_PER_MIN; 0 = no cap)
+REQUESTS_PER_MINUTE = max(0, int(os.environ.get("OCR_REQUESTS_PER_MIN", 0)))
+# Embedded characters above which a PDF page's own text layer is used instead of OCR
+MIN_TEXT_LAYER_CHARS = 50
+# ...provided at least this share of them are letters/digits; broken font encodings yield mostly symbols
+MIN_TEXT_LAYER_ALNUM_RATIO = 0.5
+# ...and images cover less than this share of the page; above it the page is OCR'd anyway, since a scan
+# carrying a digital fax header, Bates stamp or letterhead has text outside the text layer
+MAX_TEXT_LAYER_IMAGE_COVERAGE = 0.1
+# Gray level below which a rendered pixel counts as ink; pages without any are skipped instead of OCR'd
+BLANK_PAGE_INK_LEVEL = 160
+_INK_TABLE = bytes(1 if level < BLANK_PAGE_INK_LEVEL else 0 for level in range(256))
+# Fully successful per-file results kept in memory, keyed by content hash
+FILE_CACHE_SIZE = 64
+# Per-page OCR text persisted across restarts, keyed by page image hash. This is patient-document text
+# in plaintext: move it with OCR_CACHE_DIR, or set OCR_CACHE_DIR to an empty string to disable it
+_ocr_cache_dir = os.environ.get("OCR_CACHE_DIR", ".ocr_cache")
+OCR_CACHE_DIR = Path(_ocr_cache_dir) if _ocr_cache_dir else None
+# Cached pages older than this are ignored and deleted (OCR_CACHE_MAX_AGE_DAYS)
+OCR_CACHE_MAX_AGE = float(os.environ.get("OCR_CACHE_MAX_AGE_DAYS", 7)) * 24 * 3600
+# Seconds between sweeps of expired cache files
+OCR_CACHE_PRUNE_INTERVAL = 3600
+
+# PyMuPDF must not be driven from several threads at once, even on separate documents, and files are
+# processed on a thread pool; every MuPDF call goes through this lock (reentrant, as an abandoned page
+# generator can be finalized while its thread already holds it)
+_MUPDF_LOCK = threading.RLock()
+# PDFs open for rendering, guarded by _MUPDF_LOCK
+_open_pdfs = 0
 
 class MedicalOCRProcessor:
     def __init__(self):
-        pass
+        self._file_cache = OrderedDict()
+        self._file_cache_lock = threading.Lock()
+        self._request_slots = threading.BoundedSemaphore(MAX_INFLIGHT_REQUESTS)
+        # One keep-alive pool for all OpenRouter calls, sized to the in-flight limit
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_INFLIGHT_REQUESTS)
+        self._session.mount("https://", adapter)
+        self._rate_tokens = float(REQUESTS_PER_MINUTE)
+        self._rate_refilled = time.monotonic()
+        self._rate_lock = threading.Lock()
+        self._ocr_cache_dir = self._open_ocr_cache_dir(OCR_CACHE_DIR)
+        self._ocr_cache_pruned = 0.0
+        self._prune_ocr_cache()
+        # Pages currently being OCR'd, by cache key, so identical pages in a batch are sent only once
+        self._inflight_pages = {}
+        self._inflight_lock = threading.Lock()
 
-    def pdf_to_images(self, pdf_file):
-        """Convert PDF pages to list of PIL images"""
-        images = []
+    def pdf_to_jpeg_pages(self, pdf_bytes, page_numbers):
+        """
+        Lazily render the given 1-based PDF pages to grayscale JPEG bytes, yielding (page number, bytes).
+        Blank pages (no pixel darker than BLANK_PAGE_INK_LEVEL) are yielded with None instead of bytes.
+        """
+        global _open_pdfs
+        doc = None
         try:
-            doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
-            for page_num in range(len(doc)):
-                page = doc.load_page(page_num)
-                pix = page.get_pixmap(dpi=200)
-                img = Image.open(io.BytesIO(pix.tobytes("png")))
-                images.append(img)
+            with _MUPDF_LOCK:
+                doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+                _open_pdfs += 1
+            for page_no in page_numbers:
+                with _MUPDF_LOCK:
+                    page = doc.load_page(page_no - 1)
+                    zoom = min(RENDER_DPI / 72, MAX_IMAGE_EDGE / max(page.rect.width, page.rect.height))
+                    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY)
+                    page_jpeg = None if self._is_blank_pixmap(pix) else pix.tobytes("jpeg", jpg_quality=JPEG_QUALITY)
+                    # Drop the pixmap before yielding; the consumer may hold the generator for a while
+                    pix = page = None
+                yield page_no, page_jpeg
         except Exception as e:
             raise RuntimeError(f"PDF to image conversion failed: {e}")
-        return images
+        finally:
+            if doc is not None:
+                with _MUPDF_LOCK:
+                    doc.close()
+                    _open_pdfs -= 1
+                    # The MuPDF store is process-wide; only empty it once no other PDF is mid-render
+                    if not _open_pdfs:
+                        fitz.TOOLS.store_shrink(100)
+
+    def _is_blank_pixmap(self, pix):
+        """True if a grayscale pixmap holds no ink, e.g. a blank scanned separator or back page"""
+        return pix.is_unicolor or b"\x01" not in pix.samples.translate(_INK_TABLE)
 
-    def image_to_base64(self, image):
-        """Convert PIL image to base64 string"""
+    def extract_text_layer(self, pdf_bytes):
+        """
+        Read the embedded text of each PDF page.
+        :param pdf_bytes: raw PDF bytes
+        :return: list with each page's text, or None where the page looks scanned and needs OCR
+        """
+        with _MUPDF_LOCK, fitz.open(stream=pdf_bytes, filetype="pdf") as doc:
+            pages = [(page.get_text("text"), self._image_coverage(page)) for page in doc]
+
+        return [
+            text if coverage < MAX_TEXT_LAYER_IMAGE_COVERAGE and self._is_usable_text_layer(text) else None
+            for text, coverage in pages
+        ]
+
+    def _image_coverage(self, page):
+        """Share of a PDF page's area covered by embedded images (overlaps counted twice, capped at 1)"""
+        page_area = page.rect.get_area()
+        if not page_area:
+            return 1.0
+        covered = sum((fitz.Rect(info["bbox"]) & page.rect).get_area() for info in page.get_image_info())
+        return min(covered / page_area, 1.0)
+
+    def _is_usable_text_layer(self, text):
+        """Whether a page's embedded text is substantial and readable enough to skip OCR"""
+        chars = [c for c in text if not c.isspace()]
+        if len(chars) < MIN_TEXT_LAYER_CHARS:
+            return False
+        return sum(c.isalnum() for c in chars) >= MIN_TEXT_LAYER_ALNUM_RATIO * len(chars)
+
+    def image_to_jpeg(self, image):
+        """Encode a PIL image as grayscale JPEG bytes, downscaled to at most MAX_IMAGE_EDGE pixels"""
+        if image.mode.startswith("I;16") or image.mode in ("I", "F"):
+            # 16/32-bit grayscale scanner output; convert("L") would clip everything above 255 to white.
+            # Done before downscaling, which fails on I;16 images with a long edge of 6400 px or more
+            image = self._scale_to_8bit(image)
+        # For JPEG uploads, let libjpeg decode straight to grayscale at a reduced scale
+        image.draft("L", (MAX_IMAGE_EDGE, MAX_IMAGE_EDGE))
+        image.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            # JPEG has no alpha; flatten onto white so transparent areas don't turn black behind dark text
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        if image.mode != "L":
+            # Same as PDF pages: colour adds bytes but nothing the OCR needs
+            image = image.convert("L")
         buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode("utf-8")
+        image.save(buffered, format="JPEG", quality=JPEG_QUALITY)
+        return buffered.getvalue()
 
-    def ocr_via_openrouter(self, images, api_key, progress_callback=None):
+    def _scale_to_8bit(self, image):
+        """Rescale a high-bit-depth grayscale image to mode L, keeping its brightness relative to full scale"""
+        is_float = image.mode == "F"
+        image = image.convert("F")
+        _, high = image.getextrema()
+        if is_float and high <= 1.0:
+            full_scale = 1.0
+        elif high <= 255:
+            full_scale = 255.0
+        elif high <= 65535:
+            full_scale = 65535.0
+        else:
+            full_scale = high
+        return image.point(lambda v: v * 255.0 / full_scale).convert("L")
+
+    def ocr_page(self, page_jpeg, idx, api_key):
         """
-        Send images to OpenRouter model (Claude Opus 4.1) for OCR.
-        :param images: list of PIL images
-        :param api_key: OpenRouter API key
-        :param progress_callback: optional function(done, total) for progress updates
-        :return: combined OCR text
+        OCR one page image, from the disk cache, an identical page already in flight, or OpenRouter.
+        :return: (OCR text or an error line, whether OCR succeeded)
+        """
+        cache_key = self._page_cache_key(page_jpeg)
+        while True:
+            cached_text = self._load_page_text(cache_key)
+            if cached_text is not None:
+                return cached_text, True
+
+            with self._inflight_lock:
+                pending = self._inflight_pages.get(cache_key)
+                if pending is None:
+                    self._inflight_pages[cache_key] = Future()
+            if pending is None:
+                break
+            text, ok = pending.result()
+            if ok:
+                return text, ok
+            # The identical page failed elsewhere; go round again so that one waiter takes over the
+            # request and the rest wait on it, instead of all of them hitting a rate-limited API at once
+
+        result = ("", False)
+        try:
+            result = self._request_page_text(page_jpeg, idx, api_key)
+            if result[1]:
+                self._store_page_text(cache_key, result[0])
+        finally:
+            with self._inflight_lock:
+                self._inflight_pages.pop(cache_key).set_result(result)
+        return result
+
+    def _request_page_text(self, page_jpeg, idx, api_key):
+        """
+        Send one page image to OpenRouter for OCR.
+        :return: (OCR text or an error line, whether the request succeeded)
         """
         url = "https://openrouter.ai/api/v1/chat/completions"
         headers = {
@@ -41,39 +227,299 @@ class MedicalOCRProcessor:
             "X-Title": "Medical OCR Analyzer"
         }
 
-        all_text = []
-        total = len(images)
-
-        for idx, img in enumerate(images, start=1):
-            if progress_callback:
-                progress_callback(idx, total)
-
-            img_b64 = self.image_to_base64(img)
-            payload = {
-                "model": "anthropic/claude-opus-4.1",  # ✅ free OCR-capable model
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "You are an OCR assistant. Extract all text exactly as seen in the image."
-                    },
-                    {
-                        "role": "user",
-                        "content": [
-                            {"type": "text", "text": f"OCR page {idx}:"},
-                            {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_b64}"}}
-                        ]
-                    }
-                ]
-            }
+        img_b64 = base64.b64encode(page_jpeg).decode("ascii")
+        payload = {
+            "model": OCR_MODEL,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": "You are an OCR assistant. Extract all text exactly as seen in the image."
+                },
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": f"OCR page {idx}:"},
+                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{img_b64}"}}
+                    ]
+                }
+            ]
+        }
+
+        try:
+            resp = self._post_with_retries(url, headers, payload)
+            resp.raise_for_status()
+            return resp.json()["choices"][0]["message"]["content"], True
+        except requests.exceptions.RequestException as e:
+            return f"⚠️ OCR request error on page {idx}: {e}", False
+        except Exception as e:
+            return f"⚠️ Unexpected error on page {idx}: {e}", False
 
+    def _post_with_retries(self, url, headers, payload):
+        """POST to OpenRouter, retrying transient failures; the last response or error is returned/raised"""
+        for attempt in range(MAX_RETRIES + 1):
+            retry_after = None
+            self._wait_for_rate_limit()
             try:
-                resp = requests.post(url, headers=headers, json=payload, timeout=120)
-                resp.raise_for_status()
-                text = resp.json()["choices"][0]["message"]["content"]
-                all_text.append(text)
-            except requests.exceptions.RequestException as e:
-                all_text.append(f"⚠️ OCR request error on page {idx}: {e}")
-            except Exception as e:
-                all_text.append(f"⚠️ Unexpected error on page {idx}: {e}")
-
-        return "\n\n".join(all_text)
+                with self._request_slots:
+                    resp = self._session.post(url, headers=headers, json=payload, timeout=120)
+            except requests.exceptions.ConnectionError:
+                if attempt == MAX_RETRIES:
+                    raise
+            else:
+                if resp.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                    return resp
+                retry_after = self._retry_after_seconds(resp)
+                if retry_after is not None and retry_after > MAX_RETRY_AFTER:
+                    return resp
+            time.sleep(self.exponential_backoff(attempt, retry_after))
+
+    def _wait_for_rate_limit(self):
+        """Block until the per-minute request budget allows another OpenRouter call"""
+        if not REQUESTS_PER_MINUTE:
+            return
+        while True:
+            with self._rate_lock:
+                now = time.monotonic()
+                refill = (now - self._rate_refilled) * REQUESTS_PER_MINUTE / 60
+                self._rate_tokens = min(REQUESTS_PER_MINUTE, self._rate_tokens + refill)
+                self._rate_refilled = now
+                if self._rate_tokens >= 1:
+                    self._rate_tokens -= 1
+                    return
+                wait = (1 - self._rate_tokens) * 60 / REQUESTS_PER_MINUTE
+            time.sleep(wait)
+
+    def exponential_backoff(self, attempt, retry_after=None):
+        """
+        Seconds to wait before retry number attempt + 1.
+        Honors the server's Retry-After if given, otherwise full jitter so concurrent
+        pages that hit a 429 together don't all retry at the same instant.
+        """
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(BASE_RETRY_DELAY * 2 ** attempt, MAX_RETRY_DELAY))
+
+    def _retry_after_seconds(self, resp):
+        """Retry-After header in seconds, or None if absent or not a number of seconds"""
+        try:
+            return max(0.0, float(resp.headers["Retry-After"]))
+        except (KeyError, ValueError):
+            return None
+
+    def _open_ocr_cache_dir(self, cache_dir):
+        """Create the page cache directory, private to this user; None (no disk cache) if disabled or unusable"""
+        if cache_dir is None:
+            return None
+        try:
+            cache_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        except OSError:
+            return None
+        return cache_dir
+
+    def _prune_ocr_cache(self):
+        """Delete expired page cache files and stray temp files, at most once per OCR_CACHE_PRUNE_INTERVAL"""
+        now = time.time()
+        if self._ocr_cache_dir is None or now - self._ocr_cache_pruned < OCR_CACHE_PRUNE_INTERVAL:
+            return
+        self._ocr_cache_pruned = now
+        for pattern in ("*.json", "*.tmp"):
+            for path in self._ocr_cache_dir.glob(pattern):
+                try:
+                    if now - path.stat().st_mtime > OCR_CACHE_MAX_AGE:
+                        path.unlink()
+                except OSError:
+                    pass
+
+    def _page_cache_key(self, page_jpeg):
+        """Cache key for a page image; the model is part of the key"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(OCR_MODEL.encode("utf-8"))
+        digest.update(page_jpeg)
+        return digest.hexdigest()
+
+    def _load_page_text(self, cache_key):
+        """A page's OCR text from the disk cache, or None if disabled, missing, unreadable or expired"""
+        if self._ocr_cache_dir is None:
+            return None
+        cache_path = self._ocr_cache_dir / f"{cache_key}.json"
+        try:
+            if time.time() - cache_path.stat().st_mtime > OCR_CACHE_MAX_AGE:
+                cache_path.unlink()
+                return None
+            return json.loads(cache_path.read_text(encoding="utf-8"))["text"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _store_page_text(self, cache_key, text):
+        """Atomically write a page's OCR text to the disk cache; failures are ignored"""
+        if self._ocr_cache_dir is None:
+            return
+        cache_path = self._ocr_cache_dir / f"{cache_key}.json"
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            tmp_path.write_text(json.dumps({"text": text}), encoding="utf-8")
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+
+    def ocr_via_openrouter(self, pages, api_key, progress_callback=None):
+        """
+        Send page images to OpenRouter model (Claude Opus 4.1) for OCR, several pages at a time.
+        :param pages: iterable of (page number, JPEG bytes, or None for a blank page that is not sent); it is
+                      drawn from only while fewer than MAX_QUEUED_PAGES pages are pending, so a lazy renderer
+                      stays just ahead of the requests
+        :param api_key: OpenRouter API key
+        :param progress_callback: optional function(done, total), called from the caller's thread as pages finish;
+                                  total counts the pages drawn so far
+        :return: ({page number: OCR text}, number of pages that failed)
+        """
+        page_texts = {}
+        failed_pages = 0
+        pending = {}
+        pages = iter(pages)
+        exhausted = False
+
+        with ThreadPoolExecutor(max_workers=MAX_PAGE_WORKERS) as executor:
+            while True:
+                while not exhausted and len(pending) < MAX_QUEUED_PAGES:
+                    page = next(pages, None)
+                    if page is None:
+                        exhausted = True
+                        continue
+                    page_no, page_jpeg = page
+                    if page_jpeg is None:
+                        page_texts[page_no] = ""
+                        if progress_callback:
+                            progress_callback(len(page_texts), len(page_texts) + len(pending))
+                    else:
+                        pending[executor.submit(self.ocr_page, page_jpeg, page_no, api_key)] = page_no
+                if not pending:
+                    break
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    text, ok = future.result()
+                    page_texts[pending.pop(future)] = text
+                    failed_pages += not ok
+                    if progress_callback:
+                        progress_callback(len(page_texts), len(page_texts) + len(pending))
+
+        return page_texts, failed_pages
+
+    def process_single_file(self, file_name, file_type, file_bytes, api_key, page_callback=None):
+        """
+        OCR a single uploaded PDF or image, reusing the result of an identical earlier upload.
+        :param file_bytes: raw file contents
+        :param page_callback: optional function(done=0, seen=0) counting pages found and pages finished;
+                              called from worker threads, so it must be thread-safe
+        :return: (OCR text or None on failure, result dict for the summary)
+        """
+        if page_callback is None:
+            page_callback = lambda done=0, seen=0: None
+
+        cache_key = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+        with self._file_cache_lock:
+            cached = self._file_cache.get(cache_key)
+            if cached is not None:
+                self._file_cache.move_to_end(cache_key)
+        if cached is not None:
+            text, result = cached
+            page_callback(done=result["pages"], seen=result["pages"])
+            return text, {**result, "filename": file_name}
+
+        try:
+            if file_type == "application/pdf":
+                page_texts = self.extract_text_layer(file_bytes)
+                ocr_page_numbers = [no for no, text in enumerate(page_texts, start=1) if text is None]
+                pages = self.pdf_to_jpeg_pages(file_bytes, ocr_page_numbers)
+            else:
+                page_texts = [None]
+                ocr_page_numbers = [1]
+                pages = [(1, self.image_to_jpeg(Image.open(io.BytesIO(file_bytes))))]
+
+            # Text-layer pages are finished as soon as they're read
+            page_callback(done=len(page_texts) - len(ocr_page_numbers), seen=len(page_texts))
+
+            failed_pages = 0
+            if ocr_page_numbers:
+                ocr_texts, failed_pages = self.ocr_via_openrouter(
+                    pages, api_key, progress_callback=lambda done, total: page_callback(done=1)
+                )
+                page_texts = [ocr_texts.get(no, text) for no, text in enumerate(page_texts, start=1)]
+
+            if not ocr_page_numbers:
+                method = "text layer"
+            elif len(ocr_page_numbers) == len(page_texts):
+                method = "OCR"
+            else:
+                method = f"text layer + OCR ({len(ocr_page_numbers)} pages)"
+
+            if not failed_pages:
+                status = "Success"
+            elif failed_pages == len(ocr_page_numbers) == len(page_texts):
+                status = f"Failed - all {failed_pages} pages failed"
+            else:
+                status = f"Partial - {failed_pages} pages failed"
+
+            text = "\n\n".join(page_texts)
+            result = {"filename": file_name, "status": status,
+                      "pages": len(page_texts), "method": method, "failed_pages": failed_pages}
+            if not failed_pages:
+                self._cache_file_result(cache_key, text, result)
+            return text, result
+        except Exception as e:
+            # Same keys as a successful row, so the results table keeps its integer columns
+            return None, {"filename": file_name, "status": f"Failed - {str(e)}",
+                          "pages": 0, "method": "", "failed_pages": 0}
+
+    def _cache_file_result(self, cache_key, text, result):
+        """Remember a fully successful file result, evicting the least recently used"""
+        with self._file_cache_lock:
+            self._file_cache[cache_key] = (text, result)
+            self._file_cache.move_to_end(cache_key)
+            while len(self._file_cache) > FILE_CACHE_SIZE:
+                self._file_cache.popitem(last=False)
+
+    def process_uploaded_files(self, uploaded_files, api_key, progress_callback=None):
+        """
+        OCR several uploaded files concurrently.
+        :param uploaded_files: list of Streamlit UploadedFile objects
+        :param api_key: OpenRouter API key
+        :param progress_callback: optional function(files_done, files_total, pages_done, pages_total), called
+                                  from the caller's thread as pages finish; pages_total grows as files are opened
+        :return: (combined OCR text, list of per-file result dicts in upload order)
+        """
+        self._prune_ocr_cache()
+        total = len(uploaded_files)
+        outcomes = [None] * total
+        page_counts = [0, 0]  # pages done, pages seen, across all files
+        page_counts_lock = threading.Lock()
+
+        def count_pages(done=0, seen=0):
+            with page_counts_lock:
+                page_counts[0] += done
+                page_counts[1] += seen
+
+        with ThreadPoolExecutor(max_workers=MAX_FILE_WORKERS) as executor:
+            futures = {
+                executor.submit(self.process_single_file, uploaded_file.name, uploaded_file.type,
+                                uploaded_file.getvalue(), api_key, count_pages): idx
+                for idx, uploaded_file in enumerate(uploaded_files)
+            }
+            pending = set(futures)
+            while pending:
+                finished, pending = wait(pending, timeout=PROGRESS_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    outcomes[futures[future]] = future.result()
+                if progress_callback:
+                    with page_counts_lock:
+                        pages_done, pages_total = page_counts
+                    progress_callback(total - len(pending), total, pages_done, pages_total)
+
+        text_parts = []
+        file_results = []
+        for uploaded_file, (text, result) in zip(uploaded_files, outcomes):
+            if text is not None:
+                text_parts.append(f"\n\n===== {uploaded_file.name} =====\n\n{text}\n")
+            file_results.append(result)
+
+        return "".join(text_parts), file_results
@@ -0,0 +1,479 @@
+import io, os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
+
+import fitz
+import pytest
+from PIL import Image, ImageDraw
+
+import medical_processor
+from conftest import PAGE_JPEG, make_response, ocr_response
+from medical_processor import MedicalOCRProcessor
+
+
+def scanned_pdf(pages):
+    """PDF whose pages are full-page images with no text layer"""
+    doc = fitz.open()
+    for page_no in range(pages):
+        # Distinct pages, so the in-flight dedupe doesn't merge them, each with a dark line of "text"
+        image = Image.new("L", (850, 1100), 100 + page_no)
+        ImageDraw.Draw(image).rectangle((100, 100, 700, 120), fill=0)
+        scan = io.BytesIO()
+        image.save(scan, format="PNG")
+        page = doc.new_page()
+        page.insert_image(page.rect, stream=scan.getvalue())
+    return doc.tobytes()
+
+
+def upload(name, data, file_type="application/pdf"):
+    return SimpleNamespace(name=name, type=file_type, getvalue=lambda: data)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        threading.Event().wait(0.01)
+
+
+# ========== In-flight dedupe ==========
+
+def test_identical_pages_in_flight_are_requested_once(processor):
+    release = threading.Event()
+
+    def post(*args, **kwargs):
+        release.wait(5)
+        return ocr_response("HEMOGLOBIN 13.5")
+
+    processor._session.post.side_effect = post
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(processor.ocr_page, PAGE_JPEG, idx, "key") for idx in range(1, 6)]
+        wait_for(lambda: processor._session.post.call_count == 1)
+        threading.Event().wait(0.2)  # let the other pages find the request in flight
+        assert len(processor._inflight_pages) == 1
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == [("HEMOGLOBIN 13.5", True)] * 5
+    assert processor._session.post.call_count == 1
+    assert processor._inflight_pages == {}
+
+
+def test_one_waiter_takes_over_when_the_owner_fails(processor, tmp_path):
+    release = threading.Event()
+    calls = []
+
+    def post(*args, **kwargs):
+        calls.append(kwargs["json"]["messages"][1]["content"][0]["text"])
+        if len(calls) == 1:
+            release.wait(5)
+            return make_response(400)
+        return ocr_response("HEMOGLOBIN 13.5")
+
+    processor._session.post.side_effect = post
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(processor.ocr_page, PAGE_JPEG, idx, "key") for idx in range(1, 6)]
+        wait_for(lambda: len(calls) == 1)
+        threading.Event().wait(0.2)
+        release.set()
+        results = [future.result() for future in futures]
+
+    owner_idx = int(calls[0].split()[-1].rstrip(":"))
+    for idx, (text, ok) in enumerate(results, start=1):
+        if idx == owner_idx:
+            assert not ok and f"page {idx}" in text
+        else:
+            assert (text, ok) == ("HEMOGLOBIN 13.5", True)
+    assert len(calls) == 2
+    assert len(list((tmp_path / "ocr_cache").glob("*.json"))) == 1
+    assert processor._inflight_pages == {}
+
+
+def test_failing_identical_pages_are_retried_one_at_a_time(processor):
+    in_flight = []
+    most_in_flight = [0]
+    lock = threading.Lock()
+
+    def post(*args, **kwargs):
+        with lock:
+            in_flight.append(1)
+            most_in_flight[0] = max(most_in_flight[0], len(in_flight))
+        threading.Event().wait(0.05)
+        with lock:
+            in_flight.pop()
+        return make_response(400)
+
+    processor._session.post.side_effect = post
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        results = list(executor.map(lambda idx: processor.ocr_page(PAGE_JPEG, idx, "key"), range(1, 6)))
+
+    for idx, (text, ok) in enumerate(results, start=1):
+        assert not ok and f"page {idx}" in text
+    assert most_in_flight[0] == 1
+    assert processor._inflight_pages == {}
+
+
+def test_owner_exception_still_releases_waiters(processor):
+    with mock.patch.object(processor, "_request_page_text", side_effect=RuntimeError("boom")):
+        with pytest.raises(RuntimeError):
+            processor.ocr_page(PAGE_JPEG, 1, "key")
+    assert processor._inflight_pages == {}
+
+
+# ========== File cache ==========
+
+@pytest.fixture
+def memory_only_processor(processor, monkeypatch):
+    """Processor without the disk cache, so only the in-memory file cache can skip requests"""
+    monkeypatch.setattr(medical_processor, "OCR_CACHE_DIR", None)
+    proc = MedicalOCRProcessor()
+    proc._session = processor._session
+    proc._session.post.side_effect = lambda *args, **kwargs: ocr_response("page")
+    return proc
+
+
+def test_identical_upload_is_served_from_the_file_cache(memory_only_processor):
+    proc = memory_only_processor
+    pdf = scanned_pdf(2)
+    first_text, first = proc.process_single_file("a.pdf", "application/pdf", pdf, "key")
+    counted = []
+
+    text, result = proc.process_single_file("b.pdf", "application/pdf", pdf, "key",
+                                            lambda done=0, seen=0: counted.append((done, seen)))
+
+    assert proc._session.post.call_count == 2
+    assert text == first_text
+    assert result == {**first, "filename": "b.pdf"}
+    assert counted == [(2, 2)]
+
+
+def test_file_cache_evicts_the_least_recently_used(memory_only_processor, monkeypatch):
+    proc = memory_only_processor
+    monkeypatch.setattr(medical_processor, "FILE_CACHE_SIZE", 2)
+    pdfs = [scanned_pdf(n) for n in (1, 2, 3)]
+
+    proc.process_single_file("1.pdf", "application/pdf", pdfs[0], "key")
+    proc.process_single_file("2.pdf", "application/pdf", pdfs[1], "key")
+    proc.process_single_file("1.pdf", "application/pdf", pdfs[0], "key")  # 1.pdf is now the most recent
+    proc.process_single_file("3.pdf", "application/pdf", pdfs[2], "key")  # evicts 2.pdf
+    requests_so_far = proc._session.post.call_count
+
+    proc.process_single_file("1.pdf", "application/pdf", pdfs[0], "key")
+    assert proc._session.post.call_count == requests_so_far
+    proc.process_single_file("2.pdf", "application/pdf", pdfs[1], "key")
+    assert proc._session.post.call_count == requests_so_far + 2
+
+
+def test_results_with_failed_pages_are_not_cached(memory_only_processor):
+    proc = memory_only_processor
+    proc._session.post.side_effect = [make_response(400), ocr_response("page")]
+    pdf = scanned_pdf(1)
+
+    _, first = proc.process_single_file("a.pdf", "application/pdf", pdf, "key")
+    text, second = proc.process_single_file("a.pdf", "application/pdf", pdf, "key")
+
+    assert first["failed_pages"] == 1
+    assert second["status"] == "Success" and text == "page"
+
+
+# ========== Disk cache ==========
+
+def test_ocr_text_is_reused_from_the_disk_cache(processor, tmp_path):
+    processor._session.post.return_value = ocr_response("cached text")
+
+    assert processor.ocr_page(PAGE_JPEG, 1, "key") == ("cached text", True)
+    assert MedicalOCRProcessor().ocr_page(PAGE_JPEG, 1, "key") == ("cached text", True)
+    assert processor._session.post.call_count == 1
+    assert (tmp_path / "ocr_cache").stat().st_mode & 0o077 == 0
+
+
+def test_disk_cache_can_be_disabled(processor, monkeypatch, tmp_path):
+    monkeypatch.setattr(medical_processor, "OCR_CACHE_DIR", None)
+    proc = MedicalOCRProcessor()
+    proc._session = processor._session
+    proc._session.post.return_value = ocr_response("text")
+
+    proc.ocr_page(PAGE_JPEG, 1, "key")
+    proc.ocr_page(PAGE_JPEG, 1, "key")
+
+    assert proc._session.post.call_count == 2
+    assert not any(tmp_path.rglob("*.json"))
+
+
+def test_unusable_cache_dir_runs_without_a_disk_cache(monkeypatch, tmp_path, sleeps):
+    (tmp_path / "not_a_dir").write_text("")
+    monkeypatch.setattr(medical_processor, "OCR_CACHE_DIR", tmp_path / "not_a_dir" / "ocr_cache")
+    proc = MedicalOCRProcessor()
+    proc._session = mock.Mock(spec=["post"])
+    proc._session.post.return_value = ocr_response("text")
+
+    assert proc.ocr_page(PAGE_JPEG, 1, "key") == ("text", True)
+
+
+def test_expired_cache_entries_are_ignored_and_pruned(processor, tmp_path):
+    processor._session.post.return_value = ocr_response("old text")
+    processor.ocr_page(PAGE_JPEG, 1, "key")
+    (cache_file,) = (tmp_path / "ocr_cache").glob("*.json")
+    stale_tmp = tmp_path / "ocr_cache" / "abc.1.2.tmp"
+    stale_tmp.write_text("")
+    expired = time.time() - medical_processor.OCR_CACHE_MAX_AGE - 60
+    os.utime(cache_file, (expired, expired))
+    os.utime(stale_tmp, (expired, expired))
+
+    processor._session.post.return_value = ocr_response("new text")
+    assert processor.ocr_page(PAGE_JPEG, 1, "key") == ("new text", True)
+    assert processor._session.post.call_count == 2
+
+    os.utime(cache_file, (expired, expired))
+    MedicalOCRProcessor()
+    assert not cache_file.exists() and not stale_tmp.exists()
+
+
+# ========== Text layer ==========
+
+FAX_HEADER = "FROM: ST MARY LAB FAX 555-0100  01/02/2024 10:31  PAGE 1 OF 1  ID 42"
+REPORT_TEXT = "Complete blood count. Hemoglobin 13.5 g/dL, within the reference range of 12.0 to 15.5 g/dL."
+
+
+def test_scanned_page_with_a_digital_header_is_ocrd(processor):
+    doc = fitz.open(stream=scanned_pdf(1))
+    doc[0].insert_text((20, 20), FAX_HEADER, fontsize=8)
+    processor._session.post.return_value = ocr_response("HEMOGLOBIN 9.1 g/dL LOW")
+
+    text, result = processor.process_single_file("fax.pdf", "application/pdf", doc.tobytes(), "key")
+
+    assert "HEMOGLOBIN 9.1 g/dL LOW" in text
+    assert result["method"] == "OCR"
+    assert processor._session.post.call_count == 1
+
+
+def test_born_digital_page_with_a_small_logo_uses_the_text_layer(processor):
+    logo = io.BytesIO()
+    Image.new("L", (40, 40), 0).save(logo, format="PNG")
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_image(fitz.Rect(20, 20, 60, 60), stream=logo.getvalue())
+    page.insert_text((20, 100), REPORT_TEXT, fontsize=9)
+
+    text, result = processor.process_single_file("report.pdf", "application/pdf", doc.tobytes(), "key")
+
+    assert REPORT_TEXT in text
+    assert result["method"] == "text layer"
+    processor._session.post.assert_not_called()
+
+
+def test_mixed_pdf_ocrs_only_scanned_pages_and_keeps_page_order(processor):
+    mixed = fitz.open()
+    mixed.new_page().insert_text((20, 100), f"Page one. {REPORT_TEXT}", fontsize=9)
+    mixed.insert_pdf(fitz.open(stream=scanned_pdf(1)))
+    mixed.new_page().insert_text((20, 100), f"Page three. {REPORT_TEXT}", fontsize=9)
+    processor._session.post.return_value = ocr_response("SCANNED DISCHARGE NOTE")
+
+    text, result = processor.process_single_file("mixed.pdf", "application/pdf", mixed.tobytes(), "key")
+
+    sent = [call.kwargs["json"]["messages"][1]["content"][0]["text"] for call in processor._session.post.call_args_list]
+    assert sent == ["OCR page 2:"]
+    assert text.index("Page one.") < text.index("SCANNED DISCHARGE NOTE") < text.index("Page three.")
+    assert result["method"] == "text layer + OCR (1 pages)"
+    assert result["pages"] == 3 and result["status"] == "Success"
+
+
+def test_garbled_text_layer_is_ocrd(processor):
+    doc = fitz.open()
+    doc.new_page().insert_text((20, 100), "\u2022 " * 60, fontsize=9)
+
+    assert processor.extract_text_layer(doc.tobytes()) == [None]
+
+
+# ========== PDF rendering ==========
+
+def test_mupdf_store_is_only_shrunk_when_no_pdf_is_rendering(processor):
+    with mock.patch.object(medical_processor.fitz.TOOLS, "store_shrink") as store_shrink:
+        first = processor.pdf_to_jpeg_pages(scanned_pdf(2), [1, 2])
+        second = processor.pdf_to_jpeg_pages(scanned_pdf(2), [1, 2])
+        next(first)
+        next(second)
+
+        assert len(list(first)) == 1
+        store_shrink.assert_not_called()
+
+        second.close()
+        store_shrink.assert_called_once_with(100)
+    assert medical_processor._open_pdfs == 0
+
+
+def test_pdfs_render_correctly_on_concurrent_files(processor):
+    processor._session.post.side_effect = lambda *args, **kwargs: ocr_response("page")
+    uploads = [upload(f"scan{n}.pdf", scanned_pdf(n)) for n in range(1, 7)]
+
+    _, results = processor.process_uploaded_files(uploads, "key")
+
+    assert [res["pages"] for res in results] == list(range(1, 7))
+    assert all(res["failed_pages"] == 0 for res in results)
+    assert medical_processor._open_pdfs == 0
+
+
+def test_pages_are_rendered_only_a_bounded_distance_ahead_of_ocr(processor, monkeypatch):
+    release = threading.Event()
+    drawn = []
+
+    def rendered_pages():
+        for page_no in range(1, 61):
+            drawn.append(page_no)
+            yield page_no, f"page {page_no}".encode()
+
+    def ocr_page(page_jpeg, idx, api_key):
+        release.wait(5)
+        return "text", True
+
+    monkeypatch.setattr(processor, "ocr_page", ocr_page)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(processor.ocr_via_openrouter, rendered_pages(), "key")
+        wait_for(lambda: len(drawn) >= medical_processor.MAX_QUEUED_PAGES)
+        threading.Event().wait(0.2)
+        assert len(drawn) == medical_processor.MAX_QUEUED_PAGES
+        release.set()
+        page_texts, failed_pages = future.result()
+
+    assert sorted(page_texts) == list(range(1, 61)) and failed_pages == 0
+
+
+def scan_with_mark(mark):
+    """Single-page PDF holding a white scan, optionally with a small dark mark at the given box"""
+    image = Image.new("L", (850, 1100), 250)
+    if mark:
+        ImageDraw.Draw(image).rectangle(mark, fill=30)
+    scan = io.BytesIO()
+    image.save(scan, format="PNG")
+    doc = fitz.open()
+    page = doc.new_page()
+    page.insert_image(page.rect, stream=scan.getvalue())
+    return doc
+
+
+def test_blank_pages_are_skipped_without_a_request(processor):
+    doc = scan_with_mark(None)
+    doc.insert_pdf(fitz.open(stream=scanned_pdf(1)))
+    doc.insert_pdf(scan_with_mark(None))
+    processor._session.post.return_value = ocr_response("DISCHARGE NOTE")
+
+    text, result = processor.process_single_file("scan.pdf", "application/pdf", doc.tobytes(), "key")
+
+    sent = [call.kwargs["json"]["messages"][1]["content"][0]["text"] for call in processor._session.post.call_args_list]
+    assert sent == ["OCR page 2:"]
+    assert text == "\n\nDISCHARGE NOTE\n\n"
+    assert result["pages"] == 3 and result["status"] == "Success"
+
+
+def test_page_with_a_small_mark_is_still_ocrd(processor):
+    # A lone initial or page number on an otherwise white page
+    doc = scan_with_mark((400, 1000, 420, 1020))
+    processor._session.post.return_value = ocr_response("7")
+
+    text, result = processor.process_single_file("scan.pdf", "application/pdf", doc.tobytes(), "key")
+
+    assert text == "7"
+    assert processor._session.post.call_count == 1
+
+
+# ========== Uploaded images ==========
+
+def jpeg_gray(jpeg_bytes):
+    image = Image.open(io.BytesIO(jpeg_bytes))
+    assert image.mode == "L"
+    return image.getpixel((image.width // 2, image.height // 2))
+
+
+@pytest.mark.parametrize("mode, value, file_format, expected", [
+    ("I;16", 30000, "PNG", 117),
+    ("I;16", 30000, "TIFF", 117),
+    ("I", 30000, "TIFF", 117),
+    ("I", 200, "TIFF", 200),
+    ("F", 0.5, "TIFF", 128),
+])
+def test_high_bit_depth_uploads_are_rescaled_not_clipped(processor, mode, value, file_format, expected):
+    scan = io.BytesIO()
+    Image.new(mode, (64, 64), value).save(scan, format=file_format)
+
+    gray = jpeg_gray(processor.image_to_jpeg(Image.open(io.BytesIO(scan.getvalue()))))
+
+    assert abs(gray - expected) <= 2
+
+
+@pytest.mark.parametrize("size", [(5100, 6600), (4960, 7016)])  # 600 DPI letter and A4
+@pytest.mark.parametrize("file_format", ["PNG", "TIFF"])
+def test_16_bit_scans_at_scanner_size_are_downscaled_and_rescaled(processor, size, file_format):
+    scan = io.BytesIO()
+    Image.new("I;16", size, 30000).save(scan, format=file_format)
+
+    jpeg = processor.image_to_jpeg(Image.open(io.BytesIO(scan.getvalue())))
+
+    assert max(Image.open(io.BytesIO(jpeg)).size) == medical_processor.MAX_IMAGE_EDGE
+    assert abs(jpeg_gray(jpeg) - 117) <= 2
+
+
+def test_transparent_uploads_are_flattened_onto_white(processor):
+    assert jpeg_gray(processor.image_to_jpeg(Image.new("RGBA", (64, 64), (0, 0, 0, 0)))) >= 253
+
+
+def test_large_uploads_are_downscaled(processor):
+    jpeg = processor.image_to_jpeg(Image.new("RGB", (4000, 3000), (90, 90, 90)))
+
+    assert max(Image.open(io.BytesIO(jpeg)).size) == medical_processor.MAX_IMAGE_EDGE
+
+
+# ========== Progress ==========
+
+def test_progress_is_reported_per_page(processor):
+    processor._session.post.side_effect = lambda *args, **kwargs: ocr_response("page")
+    reports = []
+
+    text, results = processor.process_uploaded_files(
+        [upload("scan.pdf", scanned_pdf(3))], "key", progress_callback=lambda *args: reports.append(args)
+    )
+
+    assert results[0]["failed_pages"] == 0 and results[0]["pages"] == 3
+    assert reports[-1] == (1, 1, 3, 3)
+
+
+def test_progress_counts_pages_while_a_file_is_in_flight(processor, monkeypatch):
+    monkeypatch.setattr(medical_processor, "PROGRESS_POLL_INTERVAL", 0.01)
+    second_page = threading.Event()
+    reports = []
+
+    def post(*args, **kwargs):
+        if "page 2" in kwargs["json"]["messages"][1]["content"][0]["text"]:
+            second_page.wait(5)
+        return ocr_response("page")
+
+    def report(*args):
+        reports.append(args)
+        if args[2] == 1:
+            second_page.set()
+
+    processor._session.post.side_effect = post
+    processor.process_uploaded_files([upload("scan.pdf", scanned_pdf(2))], "key", progress_callback=report)
+
+    assert (0, 1, 1, 2) in reports
+    assert reports[-1] == (1, 1, 2, 2)
+
+
+# ========== Result rows ==========
+
+def test_files_with_failed_pages_are_not_reported_as_success(processor):
+    def post(*args, **kwargs):
+        page = kwargs["json"]["messages"][1]["content"][0]["text"]
+        return make_response(400) if page in ("OCR page 1:", "OCR page 2:") else ocr_response("page")
+
+    processor._session.post.side_effect = post
+    uploads = [upload("partial.pdf", scanned_pdf(3)), upload("failed.pdf", scanned_pdf(2)),
+               upload("broken.pdf", b"not a pdf")]
+
+    _, results = processor.process_uploaded_files(uploads, "key")
+
+    assert [res["status"] for res in results[:2]] == ["Partial - 2 pages failed", "Failed - all 2 pages failed"]
+    assert results[2]["status"].startswith("Failed - ")
+    for res in results:
+        assert set(res) == {"filename", "status", "pages", "method", "failed_pages"}
+        assert isinstance(res["pages"], int) and isinstance(res["failed_pages"], int)
@@ -0,0 +1,62 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import medical_processor
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    now = [0.0]
+    recorded = []
+
+    def sleep(seconds):
+        recorded.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(medical_processor.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(medical_processor.time, "sleep", sleep)
+    return now, recorded
+
+
+def test_token_bucket_allows_a_burst_then_paces_requests(processor, monkeypatch, fake_clock):
+    now, slept = fake_clock
+    monkeypatch.setattr(medical_processor, "REQUESTS_PER_MINUTE", 60)
+    processor._rate_tokens, processor._rate_refilled = 60.0, now[0]
+
+    for _ in range(60):
+        processor._wait_for_rate_limit()
+    assert slept == []
+
+    for _ in range(3):
+        processor._wait_for_rate_limit()
+    assert sum(slept) == pytest.approx(3.0)
+
+    # Idle time refills the bucket, but never beyond one minute's burst
+    now[0] += 600
+    slept.clear()
+    for _ in range(60):
+        processor._wait_for_rate_limit()
+    assert slept == []
+    processor._wait_for_rate_limit()
+    assert sum(slept) == pytest.approx(1.0)
+
+
+def test_token_bucket_is_shared_across_threads(processor, monkeypatch):
+    monkeypatch.setattr(medical_processor, "REQUESTS_PER_MINUTE", 60)
+    processor._rate_tokens, processor._rate_refilled = 60.0, time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda _: processor._wait_for_rate_limit(), range(60)))
+
+    assert processor._rate_tokens < 1
+
+
+def test_token_bucket_is_off_by_default(processor, fake_clock):
+    _, slept = fake_clock
+    assert medical_processor.REQUESTS_PER_MINUTE == 0
+
+    for _ in range(1000):
+        processor._wait_for_rate_limit()
+    assert slept == []
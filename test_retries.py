@@ -0,0 +1,79 @@
+import requests
+
+import medical_processor
+from conftest import PAGE_JPEG, make_response, ocr_response
+
+
+def test_rate_limited_request_is_retried_until_it_succeeds(processor, sleeps):
+    processor._session.post.side_effect = [make_response(429), make_response(429), ocr_response("ok")]
+
+    assert processor.ocr_page(PAGE_JPEG, 1, "key") == ("ok", True)
+    assert processor._session.post.call_count == 3
+    assert len(sleeps) == 2
+
+
+def test_retries_stop_after_max_retries(processor, sleeps):
+    processor._session.post.return_value = make_response(503)
+
+    text, ok = processor.ocr_page(PAGE_JPEG, 1, "key")
+
+    assert not ok and "503" in text
+    assert processor._session.post.call_count == medical_processor.MAX_RETRIES + 1
+    assert len(sleeps) == medical_processor.MAX_RETRIES
+
+
+def test_connection_errors_are_retried_then_reported(processor):
+    processor._session.post.side_effect = requests.exceptions.ConnectionError("reset")
+
+    text, ok = processor.ocr_page(PAGE_JPEG, 1, "key")
+
+    assert not ok and "reset" in text
+    assert processor._session.post.call_count == medical_processor.MAX_RETRIES + 1
+
+
+def test_client_errors_are_not_retried(processor, sleeps):
+    processor._session.post.return_value = make_response(401)
+
+    _, ok = processor.ocr_page(PAGE_JPEG, 1, "key")
+
+    assert not ok
+    assert processor._session.post.call_count == 1
+    assert sleeps == []
+
+
+def test_backoff_is_jittered_within_its_exponential_cap(processor, sleeps):
+    processor._session.post.return_value = make_response(503)
+
+    for _ in range(20):
+        processor.ocr_page(PAGE_JPEG, 1, "key")
+
+    per_attempt = [sleeps[attempt::medical_processor.MAX_RETRIES] for attempt in range(medical_processor.MAX_RETRIES)]
+    for attempt, delays in enumerate(per_attempt):
+        cap = min(medical_processor.BASE_RETRY_DELAY * 2 ** attempt, medical_processor.MAX_RETRY_DELAY)
+        assert all(0 <= delay <= cap for delay in delays)
+        assert len(set(delays)) > 1
+
+
+def test_retry_after_header_sets_the_delay(processor, sleeps):
+    processor._session.post.side_effect = [make_response(429, headers={"Retry-After": "5"}), ocr_response("ok")]
+
+    assert processor.ocr_page(PAGE_JPEG, 1, "key") == ("ok", True)
+    assert sleeps == [5.0]
+
+
+def test_retry_after_longer_than_the_backoff_cap_is_waited_out_in_full(processor, sleeps):
+    processor._session.post.side_effect = [make_response(429, headers={"Retry-After": "60"}), ocr_response("ok")]
+
+    assert processor.ocr_page(PAGE_JPEG, 1, "key") == ("ok", True)
+    assert sleeps == [60.0]
+
+
+def test_retry_after_beyond_the_limit_fails_without_retrying(processor, sleeps):
+    retry_after = str(int(medical_processor.MAX_RETRY_AFTER) + 1)
+    processor._session.post.return_value = make_response(429, headers={"Retry-After": retry_after})
+
+    text, ok = processor.ocr_page(PAGE_JPEG, 1, "key")
+
+    assert not ok and "429" in text
+    assert processor._session.post.call_count == 1
+    assert sleeps == []